@@ -5,13 +5,17 @@ from datetime import datetime
 from datetime import timezone
 from dotenv import load_dotenv
 import logging
+import anyio
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 
 from intent_classifier import IntentClassifier
 from db.auth import conditional_auth
+from db.engine import PredictionLogger, ping_mongo
 from app import services
+from app.batching import BatchQueue
+from app.metrics import LOG_INSERT_LATENCY, metrics_app
+from app.schema import PredictionResponse, ModelLabels
 
 
 from contextlib import asynccontextmanager
@@ -26,6 +30,15 @@ load_dotenv()
 ENV = os.getenv("ENV", "prod").lower()
 logger.info(f"Running in {ENV} mode")
 
+# Parâmetros do agrupamento dinâmico (dynamic batching) das predições.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+MAX_BATCH_DELAY_MS = float(os.getenv("MAX_BATCH_DELAY_MS", "10"))
+
+# Número máximo de threads do threadpool usado para tarefas bloqueantes (hoje, apenas a
+# consulta de tokens no MongoDB). A inferência dos modelos não usa esse threadpool: cada
+# modelo tem a sua própria thread. Só é aplicado se definido, e nunca abaixo do padrão do AnyIO (40).
+THREADPOOL_SIZE = os.getenv("THREADPOOL_SIZE")
+
 # Dicionário global para armazenar os modelos carregados.
 MODELS = {}
 
@@ -41,9 +54,13 @@ def get_model_urls() -> str:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Inicialização do app. Atualmente, apenas carrega modelos do W&B.
+    Inicialização do app. Carrega modelos do W&B e inicia as filas de predição
+    e de log (ambas processadas em lote).
     """
     global MODELS
+    if THREADPOOL_SIZE:
+        thread_limiter = anyio.to_thread.current_default_thread_limiter()
+        thread_limiter.total_tokens = max(thread_limiter.total_tokens, int(THREADPOOL_SIZE))
     logger.info("Carregando modelos do W&B durante a inicialização do app...")
     try:
         model_urls_str = get_model_urls()
@@ -53,10 +70,24 @@ async def lifespan(app: FastAPI):
         logger.error(f"Falha crítica ao carregar modelos do W&B: {str(e)}")
         logger.error(traceback.format_exc())
         raise Exception(f"Falha crítica ao carregar modelos do W&B: {str(e)}")
+    app.state.batch_queue = BatchQueue(MODELS,
+                                       max_batch_size=MAX_BATCH_SIZE,
+                                       max_delay=MAX_BATCH_DELAY_MS / 1000)
+    app.state.batch_queue.start()
+    try:
+        await ping_mongo()
+        logger.info("Conexão com o MongoDB estabelecida.")
+    except Exception as e:
+        # Os logs são gravados em segundo plano: o app pode subir sem o banco.
+        logger.warning(f"Não foi possível conectar ao MongoDB na inicialização: {e}")
+    app.state.prediction_logger = PredictionLogger(observe_insert_latency=LOG_INSERT_LATENCY.observe)
+    app.state.prediction_logger.start()
     # This is the point where the app is ready to handle requests
     yield
     # Código para ser executado no shutdown (opcional)
     logger.info("Descarregando modelos e limpando recursos...")
+    await app.state.batch_queue.stop()
+    await app.state.prediction_logger.stop()
     MODELS.clear()
 
 
@@ -84,6 +115,10 @@ app.add_middleware(
 )
 
 
+# Métricas no formato do Prometheus (tempos de fila, inferência e gravação no BD).
+app.mount("/metrics", metrics_app())
+
+
 """
 Routes
 """
@@ -91,8 +126,19 @@ Routes
 async def root():
     return {"message": f"Basic ML App is running in {ENV} mode"}
 
-@app.post("/predict")
-async def predict(text: str, owner: str = Depends(conditional_auth)):
+@app.get("/labels/{model_name}", response_model=ModelLabels)
+async def labels(model_name: str, owner: str = Depends(conditional_auth)):
+    """
+    Retorna os rótulos de um modelo. As probabilidades do /predict vêm em
+    uma lista nessa mesma ordem (os clientes podem guardar os rótulos em cache).
+    """
+    try:
+        return services.get_model_labels(model_name, MODELS)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Modelo '{model_name}' não encontrado.")
+
+@app.post("/predict", response_model=PredictionResponse)
+async def predict(text: str, request: Request, owner: str = Depends(conditional_auth)):
     """
     Endpoint de predição.
     Este é um 'Controller' enxuto. 
@@ -100,13 +146,16 @@ async def predict(text: str, owner: str = Depends(conditional_auth)):
     """
     try:
         # 1. O Controller delega TODA a lógica de negócio para o services.py
-        results = services.predict_and_log_intent(
+        results = await services.predict_and_log_intent(
             text=text, 
             owner=owner, 
-            models=MODELS
+            batch_queue=request.app.state.batch_queue,
+            prediction_logger=request.app.state.prediction_logger
         )
-        # 2. O Controller retorna a resposta (Lógica de View) no formato JSON
-        return JSONResponse(content=results)
+        # 2. O Controller retorna a resposta (Lógica de View). O resultado já é um
+        #    PredictionResponse: o FastAPI reaproveita a instância na validação do
+        #    `response_model` e apenas a serializa para JSON via Pydantic (em Rust).
+        return results
     except Exception as e:
         logger.error(f"Erro ao processar a predição: {str(e)}")
         logger.error(traceback.format_exc())
@@ -116,4 +165,8 @@ async def predict(text: str, owner: str = Depends(conditional_auth)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Um processo por núcleo de CPU (ou WEB_CONCURRENCY). Os modelos são carregados no
+    # `lifespan`, ou seja, cada worker carrega a sua própria cópia após o fork.
+    # Para usar vários workers o app precisa ser passado como string de importação.
+    uvicorn.run("app.app:app", host="0.0.0.0", port=8000,
+                workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+Agrupamento dinâmico (dynamic batching) das requisições de predição.
+
+Cada chamada a `/predict` coloca o seu texto em uma fila assíncrona e aguarda
+uma `Future`. Uma corrotina de fundo drena a fila, juntando até `max_batch_size`
+textos (ou o que chegar em `max_delay` segundos), executa UMA predição por modelo
+para o lote inteiro e distribui os resultados de volta para cada requisição.
+
+Assim, o custo fixo de cada chamada ao TensorFlow é dividido entre várias
+requisições concorrentes.
+
+A fila também é a única "dona" dos modelos: cada modelo roda em uma thread
+dedicada a ele, de modo que o estado do TensorFlow nunca é acessado por
+várias threads ao mesmo tempo. O servidor web apenas enfileira textos e
+aguarda respostas.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app import services
+from app.metrics import PREDICT_LATENCY, BATCH_SIZE
+from app.schema import SinglePrediction
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQueue:
+    """
+    Fila de predições que agrupa requisições concorrentes em lotes.
+
+    :param models: Dicionário {nome_do_modelo: IntentClassifier}.
+    :param max_batch_size: Número máximo de textos por lote.
+    :param max_delay: Tempo máximo (em segundos) de espera para completar um lote.
+    """
+    def __init__(self, models: Dict, max_batch_size: int = 32, max_delay: float = 0.01):
+        # Os modelos não mudam depois da inicialização: guardamos uma tupla fixa
+        # em vez de iterar sobre o dicionário a cada lote.
+        self.model_items = tuple(models.items())
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Uma thread exclusiva por modelo
+        self._executors = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{name}")
+                           for name in models}
+        # Lote atual: itens já retirados da fila, mas ainda sem resultado
+        # (só é esvaziado depois que os resultados são distribuídos)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Inicia a corrotina de fundo que consome a fila."""
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Interrompe a corrotina de fundo e cancela as requisições pendentes."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while not self.queue.empty():
+            self._pending.append(self.queue.get_nowait())
+        for _, fut in self._pending:
+            if not fut.done():
+                fut.cancel()
+        self._pending = []
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+    async def predict(self, text: str) -> Dict[str, SinglePrediction]:
+        """
+        Enfileira um texto e aguarda o resultado da predição do seu lote.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        with PREDICT_LATENCY.labels("batch").time():
+            await self.queue.put((text, fut))
+            return await fut
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """
+        Aguarda o primeiro item da fila e depois junta mais itens até encher o
+        lote ou estourar o prazo de `max_delay`. O lote continua em `_pending`
+        até o fim da inferência, para que `stop()` possa cancelá-lo.
+        """
+        loop = asyncio.get_running_loop()
+        self._pending.append(await self.queue.get())
+        deadline = loop.time() + self.max_delay
+        while len(self._pending) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return self._pending
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+            BATCH_SIZE.observe(len(texts))
+            try:
+                with PREDICT_LATENCY.labels("inference").time():
+                    predictions = await services.predict_intents(texts, self.model_items, self._executors)
+            except Exception as e:
+                logger.error(f"Falha ao processar lote de {len(texts)} texto(s): {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                # Requisições canceladas (ex: cliente desconectou) já estão 'done'
+                for (_, fut), prediction in zip(batch, predictions):
+                    if not fut.done():
+                        fut.set_result(prediction)
+            self._pending = []
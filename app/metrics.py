@@ -0,0 +1,42 @@
+"""
+Métricas do serviço no formato do Prometheus, expostas em `/metrics`.
+
+Servem para descobrir onde o tempo de uma predição é realmente gasto
+(espera na fila, inferência ou gravação no banco) antes de otimizar.
+
+Com vários workers (WEB_CONCURRENCY > 1), cada processo tem as suas próprias
+métricas. Nesse caso, defina PROMETHEUS_MULTIPROC_DIR com um diretório vazio
+para que `/metrics` agregue os valores de todos os workers.
+"""
+
+import os
+from dotenv import load_dotenv
+
+# O modo multiprocesso é decidido na importação do prometheus_client, então o
+# PROMETHEUS_MULTIPROC_DIR do .env precisa ser carregado antes dela.
+load_dotenv()
+
+from prometheus_client import CollectorRegistry, Histogram, make_asgi_app, multiprocess
+
+# Tempo gasto em cada etapa do /predict:
+# - "batch": tempo que uma requisição espera pela sua predição (fila + inferência do lote)
+# - "inference": tempo de inferência de um lote (todos os modelos)
+PREDICT_LATENCY = Histogram("predict_seconds", "Tempo gasto em cada etapa do /predict", ["stage"])
+
+# Número de textos em cada lote enviado aos modelos.
+BATCH_SIZE = Histogram("predict_batch_size", "Número de textos por lote de predição",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+# Tempo de cada `insert_many` dos logs de predição no MongoDB.
+LOG_INSERT_LATENCY = Histogram("mongo_insert_seconds", "Tempo de gravação de um lote de logs de predição no MongoDB")
+
+
+def metrics_app():
+    """
+    Cria a aplicação ASGI que expõe as métricas (montada em `/metrics`).
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app()
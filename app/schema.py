@@ -14,15 +14,20 @@ Eles são usados diretamente pelo FastAPI para:
 """
 
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 class SinglePrediction(BaseModel):
     top_intent: str
-    all_probs: Dict[str, float]
+    # Probabilidades na mesma ordem dos rótulos retornados por GET /labels/{model_name}
+    probs: List[float]
 
 class PredictionResponse(BaseModel):
     id: Optional[str] = None 
     text: str
     owner: str
     predictions: Dict[str, SinglePrediction]
-    timestamp: int
\ No newline at end of file
+    timestamp: int
+
+class ModelLabels(BaseModel):
+    model: str
+    labels: List[str]
@@ -1,60 +1,147 @@
-from typing import Dict
-from datetime import datetime, timezone
-from intent_classifier import IntentClassifier
-from db.engine import log_prediction
-from app.schema import SinglePrediction, PredictionResponse
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Tuple, TYPE_CHECKING
+import time
+from intent_classifier import IntentClassifier, fetch_artifact_from_wandb
+from db.engine import log_prediction, PredictionLogger
+from app.schema import SinglePrediction, PredictionResponse, ModelLabels
 import logging
 
+if TYPE_CHECKING:
+    from app.batching import BatchQueue
+
 logger = logging.getLogger(__name__)
 
+# Número de predições "de aquecimento" feitas logo após carregar cada modelo.
+WARMUP_ROUNDS = 3
+# Número máximo de modelos baixados em paralelo na inicialização.
+MAX_LOADING_THREADS = 8
+
 # services.py
 def load_all_classifiers(models_to_load_str) -> dict:
     """
     Carrega todos os modelos de ML especificados na variável de ambiente
     WANDB_MODELS a partir do registro do Weights & Biases.
+    Os artefatos são baixados em paralelo (o download libera o GIL), então o
+    tempo de inicialização não cresce linearmente com o número de modelos.
+    Já a construção dos modelos (wandb.init e desserialização do Keras, que não
+    são thread-safe) é feita um modelo por vez.
     """
-    MODELS = {}
     model_urls = [url.strip() for url in models_to_load_str.split(',') if url.strip()]
     logger.info(f"Carregando {len(model_urls)} modelo(s) do W&B...")
-    for url in model_urls:
-        try:
-            # 2. Extrair o nome do modelo da URL
-            model_name = url.split('/')[-1].split(':')[0]
-            # 3. Carregar o modelo usando o IntentClassifier
-            logger.info(f"Carregando modelo: '{model_name}' (de {url})")
-            MODELS[model_name] = IntentClassifier(load_model=url)
-            logger.info(f"Modelo '{model_name}' carregado com sucesso.")
-        except Exception as e:
-            logger.error(f"Falha ao carregar o modelo de '{url}': {e}")
-            # Parar a inicialização do app se falhar ao carregar um modelo.
-            raise Exception(f"Falha ao carregar o modelo de '{url}': {e}")
+    if not model_urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_LOADING_THREADS, len(model_urls))) as executor:
+        # `map` preserva a ordem das URLs e propaga a primeira exceção
+        downloads = list(executor.map(download_classifier, model_urls))
+    MODELS = dict(load_classifier(url, model_path, config_path)
+                  for url, (model_path, config_path) in zip(model_urls, downloads))
     return MODELS
 
 
-def predict_and_log_intent(
+def download_classifier(url: str) -> Tuple[str, str]:
+    """
+    Baixa o artefato de um modelo do W&B.
+    Retorna a tupla (caminho_do_modelo, caminho_da_config).
+    """
+    try:
+        logger.info(f"Baixando modelo de {url}")
+        return fetch_artifact_from_wandb(url)
+    except Exception as e:
+        logger.error(f"Falha ao baixar o modelo de '{url}': {e}")
+        # Parar a inicialização do app se falhar ao baixar um modelo.
+        raise Exception(f"Falha ao baixar o modelo de '{url}': {e}")
+
+
+def load_classifier(url: str, model_path: str, config_path: str) -> Tuple[str, IntentClassifier]:
+    """
+    Carrega (e aquece) um único modelo a partir dos arquivos já baixados do W&B.
+    Retorna a tupla (nome_do_modelo, modelo).
+    """
+    try:
+        # 2. Extrair o nome do modelo da URL
+        model_name = url.split('/')[-1].split(':')[0]
+        # 3. Carregar o modelo usando o IntentClassifier
+        logger.info(f"Carregando modelo: '{model_name}' (de {url})")
+        model = IntentClassifier(config=config_path, load_model=model_path)
+        logger.info(f"Modelo '{model_name}' carregado com sucesso.")
+        warmup_classifier(model_name, model)
+        return model_name, model
+    except Exception as e:
+        logger.error(f"Falha ao carregar o modelo de '{url}': {e}")
+        # Parar a inicialização do app se falhar ao carregar um modelo.
+        raise Exception(f"Falha ao carregar o modelo de '{url}': {e}")
+
+
+def warmup_classifier(model_name: str, model: IntentClassifier) -> None:
+    """
+    Executa algumas predições descartáveis para que o TensorFlow construa
+    (e otimize) o grafo de execução ainda na inicialização, e não na primeira
+    requisição real.
+    """
+    try:
+        for _ in range(WARMUP_ROUNDS):
+            model.predict_batch(["warmup"])
+        logger.info(f"Modelo '{model_name}' aquecido ({WARMUP_ROUNDS} predições).")
+    except Exception as e:
+        # O aquecimento é apenas uma otimização: não impede a inicialização.
+        logger.warning(f"Falha ao aquecer o modelo '{model_name}': {e}")
+
+
+async def predict_intents(
+    texts: List[str],
+    model_items: Tuple[Tuple[str, IntentClassifier], ...],
+    executors: Dict[str, Executor]
+) -> List[Dict[str, SinglePrediction]]:
+    """
+    Executa as predições de ML para um lote de textos.
+    `model_items` é uma tupla fixa de pares (nome_do_modelo, modelo), montada
+    uma única vez após o carregamento dos modelos.
+    Cada modelo é chamado UMA vez com a lista inteira de textos, no executor
+    dedicado a ele (a inferência do TensorFlow é bloqueante), e os modelos
+    rodam em paralelo entre si.
+    Retorna, para cada texto, um dicionário {nome_do_modelo: SinglePrediction}.
+    """
+    loop = asyncio.get_running_loop()
+    outputs = await asyncio.gather(*[loop.run_in_executor(executors[model_name], model.predict_batch, texts)
+                                     for model_name, model in model_items])
+    predictions = [{} for _ in texts]
+    for (model_name, _), model_outputs in zip(model_items, outputs):
+        for text_predictions, (top_intent, probs) in zip(predictions, model_outputs):
+            text_predictions[model_name] = SinglePrediction(top_intent=top_intent, probs=probs)
+    return predictions
+
+
+def get_model_labels(model_name: str, models: Dict[str, IntentClassifier]) -> ModelLabels:
+    """
+    Retorna os rótulos (intenções) de um modelo, na mesma ordem das
+    probabilidades (`probs`) retornadas pelo /predict.
+    """
+    if model_name not in models:
+        raise KeyError(model_name)
+    return ModelLabels(model=model_name, labels=[str(code) for code in models[model_name].codes])
+
+
+async def predict_and_log_intent(
     text: str, 
     owner: str, 
-    models: Dict[str, IntentClassifier]
-) -> Dict:
+    batch_queue: "BatchQueue",
+    prediction_logger: PredictionLogger
+) -> PredictionResponse:
     """
-    1. Executa as predições de ML.
+    1. Executa as predições de ML (agrupadas em lote pela BatchQueue).
     2. Formata o resultado.
-    3. Envia o resultado para o log no banco de dados.
+    3. Envia o resultado para o log no banco de dados (gravado em lote).
     4. Retorna o resultado final formatado.
     """
     # 1. Executa predições (Lógica de ML)
-    predictions = {}
-    for model_name, model in models.items():
-        top_intent, all_probs = model.predict(text)
-        predictions[model_name] = SinglePrediction(top_intent=top_intent, all_probs=all_probs)
+    predictions = await batch_queue.predict(text)
     # 2. Formata o documento de log (Lógica de Dados)
     log_document = PredictionResponse(text=text, 
                                       owner=owner, 
                                       predictions=predictions, 
-                                      timestamp=int(datetime.now(timezone.utc).timestamp()))
+                                      timestamp=int(time.time()))  # Unix epoch (UTC)
     # 3. Salva no BD (Lógica de Persistência) usando a engine.py
-    final_result = log_prediction(log_document)
+    final_result = log_prediction(log_document, prediction_logger)
     # 4. Retorna o resultado final formatado
     return final_result
-
-
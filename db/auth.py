@@ -9,9 +9,15 @@ python db/auth.py read_all
 """
 
 import uuid
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
 from datetime import datetime, timedelta
 from db.engine import get_mongo_collection
-from fastapi import Request, HTTPException
+from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 import os
 
@@ -72,38 +78,98 @@ class TokenManager:
 
 
 
-def verify_token(request: Request):
-    token = request.headers.get("Authorization")
-    if not token:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
+# Cache em memória dos tokens válidos, para não consultar o MongoDB a cada requisição.
+# Um token desativado no banco continua aceito por no máximo AUTH_CACHE_TTL segundos.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_MAX_SIZE = 1024
+_token_cache: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Lê o header `Authorization: Bearer <token>`. Sem `auto_error`, para que o modo dev
+# funcione sem header e para devolvermos as nossas próprias mensagens de erro.
+bearer_scheme = HTTPBearer(auto_error=False)
 
-    token = token.replace("Bearer ", "")
-    tokens_collection = get_mongo_collection("api_tokens")
-    token_entry = tokens_collection.find_one({"token": token, "active": True})
 
+def get_cached_token(token: str) -> Optional[dict]:
+    """
+    Retorna o token do cache em memória, se ainda estiver dentro do TTL.
+    Não acessa o banco, então pode ser chamada direto no event loop.
+    """
+    now = time.monotonic()
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+        if cached is not None and now - cached[1] < AUTH_CACHE_TTL:
+            _token_cache.move_to_end(token)
+            return cached[0]
+    return None
+
+
+def find_active_token(token: str) -> Optional[dict]:
+    """
+    Busca um token ativo no MongoDB, usando o cache em memória quando possível.
+    Apenas tokens encontrados são guardados no cache.
+    """
+    token_entry = get_cached_token(token)
+    if token_entry is not None:
+        return token_entry
+
+    now = time.monotonic()
+    tokens_collection = get_mongo_collection("api_tokens")
+    token_entry = tokens_collection.find_one({"token": token, "active": True},
+                                             {"owner": 1, "expires_at": 1})
+    if token_entry:
+        with _token_cache_lock:
+            _token_cache[token] = (token_entry, now)
+            _token_cache.move_to_end(token)
+            if len(_token_cache) > AUTH_CACHE_MAX_SIZE:
+                _token_cache.popitem(last=False)
+    return token_entry
+
+
+def check_token_entry(token_entry: Optional[dict]) -> str:
+    """
+    Valida um token encontrado (ou não) e retorna o seu 'owner'.
+    """
     if not token_entry:
         raise HTTPException(status_code=403, detail="Invalid or inactive token")
 
+    # A expiração é checada a cada requisição, mesmo para tokens em cache.
     if datetime.utcnow() > token_entry["expires_at"]:
         raise HTTPException(status_code=403, detail="Token expired")
 
     return token_entry["owner"]
 
 
-async def conditional_auth(request: Request):
+def verify_token(credentials: Optional[HTTPAuthorizationCredentials]):
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+
+    return check_token_entry(find_active_token(credentials.credentials))
+
+
+async def conditional_auth(request: Request,
+                           credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
     """
     Retorna o 'owner' baseado no modo do ambiente (dev ou prod).
     Esta função agora é o 'Depends' principal para as rotas.
+    Tokens em cache são validados direto no event loop; apenas a consulta ao
+    banco (bloqueante) roda no threadpool.
     """
     if ENV == "dev":
         return "dev_user"
-    else:
-        try:
-            return verify_token(request)
-        except HTTPException as he:
-            raise he
-        except Exception as e:
-            raise HTTPException(status_code=401, detail="Authentication failed")
+    # O HTTPBearer ignora headers sem o prefixo "Bearer " (ex: o token puro)
+    if credentials is None and request.headers.get("Authorization"):
+        raise HTTPException(status_code=401, detail="Invalid Authorization header, expected 'Bearer <token>'")
+    try:
+        if credentials is not None:
+            token_entry = get_cached_token(credentials.credentials)
+            if token_entry is not None:
+                return check_token_entry(token_entry)
+        return await run_in_threadpool(verify_token, credentials)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=401, detail="Authentication failed")
 
             
 if __name__ == "__main__":
@@ -1,5 +1,12 @@
 import os
-from pymongo import MongoClient
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Callable, List, Optional
+from bson import ObjectId
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
@@ -7,44 +14,183 @@ load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", None)
 MONGO_DB = os.getenv("MONGO_DB", None)
+# Configuração dos pools de conexão (um cliente síncrono e um assíncrono por processo).
+# Compressores indisponíveis (ex: sem o pacote python-snappy) são ignorados pelo PyMongo.
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "200")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    "compressors": os.getenv("MONGO_COMPRESSORS", "snappy,zlib"),
+}
+# Conexões mantidas abertas pelo cliente síncrono, usado pela consulta de tokens
+# (a única operação no banco feita em paralelo, a cada requisição sem token em cache).
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
 ENV = os.getenv("ENV", "prod").lower()
+# Os logs de predição são gravados em lote: a cada LOG_FLUSH_MAX_DOCS documentos
+# ou a cada LOG_FLUSH_INTERVAL_MS milissegundos, o que ocorrer primeiro.
+LOG_FLUSH_MAX_DOCS = int(os.getenv("LOG_FLUSH_MAX_DOCS", "500"))
+LOG_FLUSH_INTERVAL_MS = float(os.getenv("LOG_FLUSH_INTERVAL_MS", "200"))
+
+logger = logging.getLogger(__name__)
+
+# Código de erro do MongoDB para `_id` duplicado.
+DUPLICATE_KEY_ERROR = 11000
 
 # --- Funções de Coleções ---
 
-def get_mongo_collection(collection_name: str):
+@lru_cache(maxsize=1)
+def get_mongo_client() -> MongoClient:
+    """
+    Cliente síncrono compartilhado pelo processo, para que o pool de conexões
+    seja reaproveitado entre as chamadas (ex: autenticação a cada requisição).
+    """
     if MONGO_URI is None or MONGO_DB is None:
         raise ValueError("MONGO_URI and MONGO_DB must be set")
-    
-    client = MongoClient(MONGO_URI)
+    return MongoClient(MONGO_URI, minPoolSize=MONGO_MIN_POOL_SIZE, **MONGO_POOL_OPTIONS)
+
+
+def get_mongo_collection(collection_name: str):
+    client = get_mongo_client()
     db = client[MONGO_DB]
     return db[collection_name]
 
 
+@lru_cache(maxsize=1)
+def get_async_mongo_client() -> AsyncMongoClient:
+    """
+    Cliente assíncrono (nativo do PyMongo) compartilhado pelo processo.
+    É usado apenas pelo `PredictionLogger`, que faz um `insert_many` por vez,
+    então não mantém um pool mínimo de conexões abertas.
+    """
+    if MONGO_URI is None or MONGO_DB is None:
+        raise ValueError("MONGO_URI and MONGO_DB must be set")
+    return AsyncMongoClient(MONGO_URI, **MONGO_POOL_OPTIONS)
+
+
+def get_async_mongo_collection(collection_name: str):
+    """
+    Versão assíncrona de `get_mongo_collection`: as operações da coleção
+    retornada devem ser aguardadas com `await` e não bloqueiam o event loop.
+    """
+    return get_async_mongo_client()[MONGO_DB][collection_name]
+
+
+async def ping_mongo(timeout: float = 5.0) -> None:
+    """
+    Faz um `ping` no MongoDB com os dois clientes, abrindo os pools de conexão
+    antes da primeira requisição (evita o custo do handshake nela). O cliente
+    síncrono, usado pela autenticação, passa a manter as suas conexões mínimas.
+    """
+    await asyncio.wait_for(asyncio.gather(
+        asyncio.to_thread(get_mongo_client().admin.command, "ping"),
+        get_async_mongo_client().admin.command("ping"),
+    ), timeout)
+
+
 # --- Funções de Log de Previsão ---
 
-def log_prediction(prediction_data) -> dict:
+class PredictionLogger:
     """
-    Insere um log de predição no banco de dados e retorna o
-    documento inserido com o ID formatado para resposta JSON.
+    Buffer em memória para os logs de predição.
+
+    As requisições apenas enfileiram os documentos (sem I/O de rede). Uma
+    corrotina de fundo drena a fila e grava os documentos no MongoDB com um
+    único `insert_many` assíncrono por lote.
+
+    :param max_docs: Número máximo de documentos por `insert_many`.
+    :param interval: Tempo máximo (em segundos) que um documento espera no buffer.
+    :param observe_insert_latency: Função chamada com a duração (em segundos) de cada
+        `insert_many` (ex: o `observe` de um histograma de métricas).
     """
-    collection = get_mongo_collection(f"{ENV.upper()}_intent_logs")
-    
-    # Converte o modelo Pydantic para um dicionário antes de inserir
-    prediction_dict = prediction_data.model_dump()
+    def __init__(self, max_docs: int = LOG_FLUSH_MAX_DOCS, interval: float = LOG_FLUSH_INTERVAL_MS / 1000,
+                 observe_insert_latency: Optional[Callable[[float], None]] = None):
+        self.max_docs = max_docs
+        self.interval = interval
+        self.observe_insert_latency = observe_insert_latency
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.collection = None
+        # Documentos já retirados da fila, mas ainda não gravados
+        self._pending: List[dict] = []
+        self._worker: Optional[asyncio.Task] = None
 
-    # Log the prediction to the database
-    try:
-        # O Pymongo modifica o dicionário `prediction_dict`, adicionando um campo `_id`.
-        result = collection.insert_one(prediction_dict)
-        
-        # Adicionamos o ID gerado como uma string para a resposta JSON
-        # e removemos o campo `_id` (do tipo ObjectId) que não é serializável.
-        prediction_dict["id"] = str(result.inserted_id)
-        prediction_dict.pop("_id", None)
+    def start(self) -> None:
+        """Inicia a corrotina de fundo que grava os logs."""
+        self._worker = asyncio.create_task(self._run())
 
-    except Exception as e:
-        # If insert_one fails, log the error and continue
-        raise Exception(f"Failed to log prediction to database. Error: {e}")
+    async def stop(self) -> None:
+        """Interrompe a corrotina de fundo e grava o que restou no buffer."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self._drain(self._pending):
+            await self._flush()
 
-    return prediction_dict
+    def put(self, document: dict) -> None:
+        """Enfileira um documento para ser gravado no próximo lote."""
+        self.queue.put_nowait(document)
 
+    def _drain(self, documents: List[dict]) -> List[dict]:
+        """Completa `documents` com o que já estiver na fila, até `max_docs`."""
+        while len(documents) < self.max_docs and not self.queue.empty():
+            documents.append(self.queue.get_nowait())
+        return documents
+
+    async def _flush(self) -> None:
+        # Os documentos só saem de `_pending` depois do `insert_many`: se o worker
+        # for cancelado no meio da gravação, `stop()` os grava de novo. Regravar é
+        # seguro, pois o `_id` é gerado no cliente e o insert não é ordenado.
+        documents = self._pending
+        if not documents:
+            return
+        try:
+            if self.collection is None:
+                self.collection = get_async_mongo_collection(f"{ENV.upper()}_intent_logs")
+            start = time.perf_counter()
+            try:
+                await self.collection.insert_many(documents, ordered=False)
+            finally:
+                if self.observe_insert_latency is not None:
+                    self.observe_insert_latency(time.perf_counter() - start)
+        except BulkWriteError as e:
+            # Documentos já gravados por uma tentativa anterior geram `DuplicateKeyError`
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY_ERROR]
+            if errors or e.details.get("writeConcernErrors"):
+                logger.error(f"Failed to log {len(errors)} of {len(documents)} prediction(s) to database. Error: {e}")
+        except Exception as e:
+            # A resposta já foi enviada ao cliente: apenas registramos a falha.
+            logger.error(f"Failed to log {len(documents)} prediction(s) to database. Error: {e}")
+        self._pending = []
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._pending.append(await self.queue.get())
+            deadline = loop.time() + self.interval
+            while len(self._drain(self._pending)) < self.max_docs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush()
+
+
+def log_prediction(prediction_data, prediction_logger: PredictionLogger):
+    """
+    Enfileira um log de predição para ser gravado no banco de dados e retorna
+    uma cópia do modelo Pydantic com o `id` preenchido, pronta para a resposta.
+
+    O `_id` é gerado aqui (no cliente), de modo que a resposta não precisa
+    esperar a gravação no MongoDB. O modelo é devolvido sem conversão para
+    dicionário: o FastAPI o serializa direto pelo `response_model`.
+    """
+    log_id = ObjectId()
+    # O documento do BD recebe o `_id` (ObjectId, não serializável em JSON);
+    # a resposta recebe apenas o ID como string.
+    prediction_logger.put({**prediction_data.model_dump(), "_id": log_id})
+    return prediction_data.model_copy(update={"id": str(log_id)})
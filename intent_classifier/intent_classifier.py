@@ -13,6 +13,8 @@ To use it as a module, you can do:
     classifier = IntentClassifier(config="models/confusion_config.yml", load_model="adaj/intent-classifier-2025-2/confusion-clf:v1")
     # predict a new text
     classifier.predict(input_text="oi")
+    # predict a batch of texts with a single forward pass (used by the API)
+    classifier.predict_batch(["oi", "não entendi"])
     # cross-validate the model
     classifier.cross_validation(n_splits=5)
 
@@ -72,6 +74,9 @@ dotenv.load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Absolute path of the models directory (resolved once, so it does not depend on the working directory)
+MODELS_DIR = Path(__file__).resolve().parent / "models"
+
 @register_keras_serializable()
 class HubLayer(tf.keras.layers.Layer):
     """
@@ -191,12 +196,13 @@ def fetch_artifact_from_wandb(model_full_name: str) -> Tuple[str, str]:
     except wandb.errors.CommError as e:
         raise ValueError(f"Could not fetch artifact '{model_full_name}' from W&B. Ensure the path is correct and you are logged in. Original error: {e}")
 
-    # Create a target directory for the download
-    models_dir = Path(os.path.dirname(__file__)) / "models"
-    models_dir.mkdir(exist_ok=True)
+    # Create a target directory for the download. Each artifact gets its own subdirectory,
+    # so artifacts downloaded in parallel never write to the same file (e.g. two `model.keras`).
+    artifact_dir = MODELS_DIR / artifact.name.replace(":", "-")
+    artifact_dir.mkdir(parents=True, exist_ok=True)
     
     # Download artifact content. The path returned is the directory where files are.
-    download_path = artifact.download(root=models_dir)
+    download_path = artifact.download(root=artifact_dir)
     
     model_file, config_file = None, None
     # Iterate over the files *in the artifact manifest* to find the correct ones.
@@ -244,6 +250,7 @@ class IntentClassifier:
         Initializes the IntentClassifier.
         """
         self.model = None
+        self._serving_fn = None
         local_model_path = None
         
         # Set up W&B project early
@@ -495,6 +502,40 @@ class IntentClassifier:
         # Ensure output is always a 0-D tensor (scalar)
         return tf.strings.as_string(text)
 
+    def preprocess_batch(self, texts: tf.Tensor) -> tf.Tensor:
+        """
+        Vectorized version of `preprocess_text` for a whole batch of texts.
+
+        Applies exactly the same steps, but with batched (ragged) string ops
+        instead of one Python call per text, so it can be traced into a single
+        graph together with the model.
+
+        :param texts: A 1-D string tensor containing the raw texts.
+        :type texts: tf.Tensor
+        :return: A 1-D string tensor containing the preprocessed texts.
+        :rtype: tf.Tensor
+        """
+        texts = tf.strings.lower(texts)
+        if self.stop_words:
+            words = tf.strings.split(texts)
+            # Keep the words that are NOT in stopwords
+            keep = tf.logical_not(tf.reduce_any(tf.equal(words.flat_values[:, None], tf.constant(self.stop_words)), axis=1))
+            words = tf.ragged.boolean_mask(words, words.with_flat_values(keep))
+            texts = tf.strings.reduce_join(words, axis=-1, separator=' ')
+
+        if self.config.min_words:
+            # Count the words of each text, ignoring punctuation
+            words = tf.strings.split(texts)
+            is_word = tf.logical_not(tf.reduce_any(tf.equal(words.flat_values[:, None], tf.constant(["?", ".", ",", "!"])), axis=1))
+            num_words = tf.reduce_sum(tf.cast(words.with_flat_values(is_word), tf.int32), axis=1)
+            padding = ' '.join(["<>"] * (self.config.min_words + 1))
+            texts = tf.where(tf.less_equal(num_words, self.config.min_words), padding, texts)
+
+        for p, t in {"?": "QUESTION_MARK", ".": "PERIOD", ",": "COMMA", "!": "EXCLAMATION_MARK"}.items():
+            texts = tf.strings.regex_replace(texts, re.escape(p), f" {t} ")
+        texts = tf.strings.regex_replace(texts, r"\s+", " ")
+        return tf.strings.strip(texts)
+
     def make_model(self, config: Config) -> tf.keras.Model:
         """
         Builds and returns a new Keras model based on the provided configuration.
@@ -580,6 +621,7 @@ class IntentClassifier:
         epochs = self.config.epochs
         # New model from scratch
         self.model = self.make_model(self.config)
+        self._serving_fn = None
         self.model.compile(
             loss='categorical_crossentropy',
             optimizer=tf.keras.optimizers.Adam(), # LR is handled by callback
@@ -692,6 +734,31 @@ class IntentClassifier:
             return results[0]
         return results
 
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, List[float]]]:
+        """
+        Predicts the intents for a batch of texts with a single forward pass.
+
+        Meant for serving: unlike `predict`, it skips the W&B logging and runs the
+        vectorized preprocessing (`preprocess_batch`) and the model in a single
+        traced `tf.function`, instead of one Python preprocessing call per text
+        followed by `Model.predict`, which builds a new data pipeline on every call.
+
+        :param texts: A non-empty list of text strings to classify.
+        :type texts: list[str]
+        :return: A list of tuples `[(top_intent, probabilities), ...]`, in the order of `texts`.
+                 `probabilities` is a list aligned with `self.codes` (no per-text dict is built).
+        :rtype: list[tuple(str, list[float])]
+        """
+        if self._serving_fn is None:
+            self._serving_fn = tf.function(
+                lambda x: self.model(self.preprocess_batch(x), training=False),
+                input_signature=[tf.TensorSpec(shape=[None], dtype=tf.string)],
+            )
+        all_probs = self._serving_fn(tf.constant(texts, dtype=tf.string)).numpy()
+        codes = list(self.codes)
+        return [(codes[top_idx], probs)
+                for top_idx, probs in zip(all_probs.argmax(axis=1).tolist(), all_probs.tolist())]
+
     def cross_validation(self, n_splits: int = 3) -> List[Dict[str, Any]]:
         """
         Performs stratified K-fold cross-validation.
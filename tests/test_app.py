@@ -1,15 +1,27 @@
 import os
 import sys
+import asyncio
+import threading
+import time
 import pytest
-from unittest.mock import MagicMock
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, AsyncMock
 from dotenv import load_dotenv
 
 # Add the project root to the path to allow importing from 'app' and 'intent_classifier'
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from fastapi.testclient import TestClient
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials
 from app.app import app
+from app.batching import BatchQueue
+from app.services import load_all_classifiers, WARMUP_ROUNDS
+from app.schema import PredictionResponse
+from db.engine import PredictionLogger, log_prediction
+from db.auth import verify_token, conditional_auth
 from intent_classifier import IntentClassifier, Config
 
 # --- Fixtures ---
@@ -21,8 +33,12 @@ def mock_app_dependencies(monkeypatch, request):
     For integration tests, it only mocks the database collection.
     """
     mock_collection = MagicMock()
-    # Mock the factory function to ensure the app uses our mock collection
+    # Prediction logs are written with the async driver, so insert_many must be awaitable
+    mock_collection.insert_many = AsyncMock()
+    # Mock the factory functions to ensure the app uses our mock collection
     monkeypatch.setattr("db.engine.get_mongo_collection", lambda name: mock_collection)
+    monkeypatch.setattr("db.engine.get_async_mongo_collection", lambda name: mock_collection)
+    monkeypatch.setattr("app.app.ping_mongo", AsyncMock())
 
     if "integration" in request.node.keywords:
         yield mock_collection, None, None
@@ -30,7 +46,9 @@ def mock_app_dependencies(monkeypatch, request):
 
     # --- Full Mocks for Unit Tests ---
     mock_model = MagicMock(spec=IntentClassifier)
-    mock_model.predict.return_value = ("mock_intent", {"mock_intent": 0.9, "other": 0.1})
+    # The app predicts in batches, so the model always receives a list of texts
+    mock_model.predict_batch.side_effect = lambda texts: [("mock_intent", [0.9, 0.1]) for _ in texts]
+    mock_model.codes = ["mock_intent", "other"]
     
     # Mock the function that loads models during app startup
     mock_load = MagicMock(return_value={"mock-model": mock_model})
@@ -47,36 +65,74 @@ def client():
     with TestClient(app) as test_client:
         yield test_client
 
+@asynccontextmanager
+async def running_batch_queue(models, **kwargs):
+    """Starts a BatchQueue for the duration of the block and always stops it afterwards."""
+    batch_queue = BatchQueue(models, **kwargs)
+    batch_queue.start()
+    try:
+        yield batch_queue
+    finally:
+        await batch_queue.stop()
+
 # --- Unit Tests ---
 
-def test_predict_dev_mode(client, monkeypatch, mock_app_dependencies):
+def test_predict_dev_mode(monkeypatch, mock_app_dependencies):
     """Tests POST /predict in 'dev' mode, which should bypass authentication."""
     monkeypatch.setattr("db.auth.ENV", "dev")
     mock_collection, mock_model, mock_verify_token = mock_app_dependencies
     
-    response = client.post("/predict", params={"text": "hello dev mode"})
+    # Logs are flushed to the database in batches, at the latest on shutdown
+    with TestClient(app) as client:
+        response = client.post("/predict", params={"text": "hello dev mode"})
     
     assert response.status_code == 200
     data = response.json()
     assert data["owner"] == "dev_user"
-    assert "mock-model" in data["predictions"]
+    assert data["predictions"]["mock-model"] == {"top_intent": "mock_intent", "probs": [0.9, 0.1]}
     
     mock_verify_token.assert_not_called()
-    mock_model.predict.assert_called_once_with("hello dev mode")
-    mock_collection.insert_one.assert_called_once()
+    mock_model.predict_batch.assert_called_once_with(["hello dev mode"])
+    mock_collection.insert_many.assert_called_once()
+    logged_docs = mock_collection.insert_many.call_args.args[0]
+    assert [str(doc["_id"]) for doc in logged_docs] == [data["id"]]
 
-def test_predict_prod_mode_auth_success(client, monkeypatch, mock_app_dependencies):
+def test_predict_prod_mode_auth_success(monkeypatch, mock_app_dependencies):
     """Tests POST /predict in 'prod' mode with successful authentication."""
     monkeypatch.setattr("db.auth.ENV", "prod")
     mock_collection, mock_model, mock_verify_token = mock_app_dependencies
 
-    response = client.post("/predict", params={"text": "hello prod"}, headers={"Authorization": "Bearer valid"})
+    with TestClient(app) as client:
+        response = client.post("/predict", params={"text": "hello prod"}, headers={"Authorization": "Bearer valid"})
     assert response.status_code == 200
     assert response.json()["owner"] == "mock_prod_user"
     
     mock_verify_token.assert_called_once()
-    mock_model.predict.assert_called_once_with("hello prod")
-    mock_collection.insert_one.assert_called_once()
+    mock_model.predict_batch.assert_called_once_with(["hello prod"])
+    mock_collection.insert_many.assert_called_once()
+
+def test_labels_dev_mode(client, monkeypatch):
+    """Tests GET /labels/{model_name}, which gives the order of the predicted probs."""
+    monkeypatch.setattr("db.auth.ENV", "dev")
+
+    response = client.get("/labels/mock-model")
+    assert response.status_code == 200
+    assert response.json() == {"model": "mock-model", "labels": ["mock_intent", "other"]}
+
+    assert client.get("/labels/unknown-model").status_code == 404
+
+def test_metrics_exposes_predict_stages(monkeypatch):
+    """Tests that /metrics reports the time spent in each /predict stage."""
+    monkeypatch.setattr("db.auth.ENV", "dev")
+
+    with TestClient(app) as client:
+        client.post("/predict", params={"text": "measure me"})
+        response = client.get("/metrics/")
+
+    assert response.status_code == 200
+    assert 'predict_seconds_count{stage="inference"}' in response.text
+    assert 'predict_seconds_count{stage="batch"}' in response.text
+    assert "predict_batch_size_count" in response.text
 
 def test_predict_prod_mode_auth_fail(client, monkeypatch, mock_app_dependencies):
     """Tests POST /predict in 'prod' mode with failed authentication."""
@@ -88,8 +144,8 @@ def test_predict_prod_mode_auth_fail(client, monkeypatch, mock_app_dependencies)
     assert response.status_code == 401
     assert "Invalid Token" in response.json()["detail"]
     
-    mock_model.predict.assert_not_called()
-    mock_collection.insert_one.assert_not_called()
+    mock_model.predict_batch.assert_not_called()
+    mock_collection.insert_many.assert_not_called()
 
 def test_predict_no_models_loaded(client, monkeypatch, mock_app_dependencies):
     """Tests the edge case where no models are loaded."""
@@ -104,7 +160,202 @@ def test_predict_no_models_loaded(client, monkeypatch, mock_app_dependencies):
     
     assert response.status_code == 200
     assert response.json()["predictions"] == {}
-    mock_collection.insert_one.assert_called_once()
+    mock_collection.insert_many.assert_called_once()
+
+def test_verify_token_caches_valid_tokens(monkeypatch):
+    """Tests that a valid token is looked up in the database only once while cached."""
+    monkeypatch.setattr("db.auth._token_cache", OrderedDict())
+    tokens_collection = MagicMock()
+    tokens_collection.find_one.return_value = {"owner": "someone", "expires_at": datetime.utcnow() + timedelta(days=1)}
+    monkeypatch.setattr("db.auth.get_mongo_collection", lambda name: tokens_collection)
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid")
+
+    # The autouse fixture mocks db.auth.verify_token, so the real one is imported below
+    assert verify_token(credentials) == "someone"
+    assert verify_token(credentials) == "someone"
+    tokens_collection.find_one.assert_called_once()
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(None)
+    assert exc_info.value.status_code == 401
+
+def test_conditional_auth_skips_threadpool_for_cached_tokens(monkeypatch):
+    """Tests that a cached token is validated on the event loop, without the threadpool."""
+    monkeypatch.setattr("db.auth.ENV", "prod")
+    monkeypatch.setattr("db.auth._token_cache", OrderedDict())
+    tokens_collection = MagicMock()
+    tokens_collection.find_one.return_value = {"owner": "someone", "expires_at": datetime.utcnow() + timedelta(days=1)}
+    monkeypatch.setattr("db.auth.get_mongo_collection", lambda name: tokens_collection)
+    mock_run_in_threadpool = AsyncMock(side_effect=lambda func, *args: func(*args))
+    monkeypatch.setattr("db.auth.run_in_threadpool", mock_run_in_threadpool)
+    monkeypatch.setattr("db.auth.verify_token", verify_token)
+    request = Request({"type": "http", "headers": [(b"authorization", b"Bearer valid")]})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid")
+
+    assert asyncio.run(conditional_auth(request, credentials)) == "someone"
+    assert asyncio.run(conditional_auth(request, credentials)) == "someone"
+    mock_run_in_threadpool.assert_called_once()
+    tokens_collection.find_one.assert_called_once()
+
+def test_predict_prod_mode_rejects_token_without_bearer_prefix(client, monkeypatch, mock_app_dependencies):
+    """Tests that a raw token (without "Bearer ") gets an explicit error, not "Missing Authorization header"."""
+    monkeypatch.setattr("db.auth.ENV", "prod")
+    _, mock_model, mock_verify_token = mock_app_dependencies
+
+    response = client.post("/predict", params={"text": "raw token"}, headers={"Authorization": "valid"})
+    assert response.status_code == 401
+    assert "Bearer <token>" in response.json()["detail"]
+
+    mock_verify_token.assert_not_called()
+    mock_model.predict_batch.assert_not_called()
+
+def test_load_all_classifiers_warms_up_models(monkeypatch):
+    """Tests that each loaded model runs warm-up predictions before serving requests."""
+    mock_model = MagicMock(spec=IntentClassifier)
+    monkeypatch.setattr("app.services.fetch_artifact_from_wandb", lambda url: ("model.keras", "model_config.yml"))
+    monkeypatch.setattr("app.services.IntentClassifier", MagicMock(return_value=mock_model))
+
+    # The autouse fixture mocks app.services.load_all_classifiers, so the real one is imported below
+    models = load_all_classifiers("user/project/confusion-clf:v1")
+
+    assert models == {"confusion-clf": mock_model}
+    assert mock_model.predict_batch.call_count == WARMUP_ROUNDS
+    mock_model.predict_batch.assert_called_with(["warmup"])
+
+def test_load_all_classifiers_keeps_model_order(monkeypatch):
+    """Tests that models downloaded in parallel keep the order given in WANDB_MODELS."""
+    monkeypatch.setattr("app.services.fetch_artifact_from_wandb", lambda url: (f"{url}.keras", f"{url}_config.yml"))
+    monkeypatch.setattr("app.services.IntentClassifier", lambda config, load_model: MagicMock(spec=IntentClassifier))
+
+    models = load_all_classifiers("u/p/clair-clf:v1, u/p/confusion-clf:v2,u/p/other-clf:v3")
+
+    assert list(models) == ["clair-clf", "confusion-clf", "other-clf"]
+
+def test_load_all_classifiers_builds_models_one_at_a_time(monkeypatch):
+    """Tests that only the downloads run in parallel: W&B and Keras loading are not thread-safe."""
+    loading, overlaps, loaded_from = [], [], []
+    def build_classifier(config, load_model):
+        overlaps.append(bool(loading))
+        loading.append(load_model)
+        time.sleep(0.01)
+        loading.remove(load_model)
+        loaded_from.append((load_model, config))
+        return MagicMock(spec=IntentClassifier)
+    monkeypatch.setattr("app.services.fetch_artifact_from_wandb", lambda url: (f"{url}.keras", f"{url}_config.yml"))
+    monkeypatch.setattr("app.services.IntentClassifier", build_classifier)
+
+    load_all_classifiers("u/p/a-clf:v1,u/p/b-clf:v1,u/p/c-clf:v1")
+
+    assert not any(overlaps)
+    assert loaded_from[0] == ("u/p/a-clf:v1.keras", "u/p/a-clf:v1_config.yml")
+
+def test_batch_queue_groups_concurrent_requests():
+    """Tests that concurrent texts are grouped into a single model call."""
+    mock_model = MagicMock(spec=IntentClassifier)
+    mock_model.predict_batch.side_effect = lambda texts: [(t, [1.0]) for t in texts]
+
+    async def run():
+        async with running_batch_queue({"mock-model": mock_model}, max_batch_size=8, max_delay=0.05) as batch_queue:
+            return await asyncio.gather(*[batch_queue.predict(t) for t in ["a", "b", "c"]])
+
+    results = asyncio.run(run())
+
+    mock_model.predict_batch.assert_called_once_with(["a", "b", "c"])
+    assert [r["mock-model"].top_intent for r in results] == ["a", "b", "c"]
+
+def test_batch_queue_runs_each_model_on_its_own_thread():
+    """Tests that every batch of a model is predicted on the same dedicated thread."""
+    threads = []
+    mock_model = MagicMock(spec=IntentClassifier)
+    mock_model.predict_batch.side_effect = lambda texts: threads.append(threading.current_thread().name) or [("x", [1.0]) for _ in texts]
+
+    async def run():
+        async with running_batch_queue({"mock-model": mock_model}, max_batch_size=1, max_delay=0) as batch_queue:
+            await asyncio.gather(*[batch_queue.predict(t) for t in ["a", "b"]])
+
+    asyncio.run(run())
+
+    assert len(threads) == 2
+    assert len(set(threads)) == 1 and threads[0].startswith("inference-mock-model")
+
+def test_batch_queue_stop_cancels_batch_being_inferred():
+    """Tests that stopping the queue mid-inference cancels the requests of that batch."""
+    started, release = threading.Event(), threading.Event()
+    mock_model = MagicMock(spec=IntentClassifier)
+    mock_model.predict_batch.side_effect = lambda texts: started.set() or release.wait(5) or [("x", [1.0]) for _ in texts]
+
+    async def run():
+        async with running_batch_queue({"mock-model": mock_model}, max_batch_size=8, max_delay=0) as batch_queue:
+            task = asyncio.create_task(batch_queue.predict("a"))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            await batch_queue.stop()
+            try:
+                await asyncio.wait_for(task, timeout=1)
+            finally:
+                release.set()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run())
+
+def test_log_prediction_keeps_response_and_document_separate():
+    """Tests that the queued document and the JSON response do not share state."""
+    prediction_logger = MagicMock(spec=PredictionLogger)
+    prediction = PredictionResponse(text="oi", owner="me", predictions={}, timestamp=0)
+
+    response = log_prediction(prediction, prediction_logger)
+
+    document = prediction_logger.put.call_args.args[0]
+    assert isinstance(response, PredictionResponse)
+    assert response.id == str(document["_id"])
+    assert prediction.id is None and document["id"] is None
+
+def test_prediction_logger_writes_in_batches(mock_app_dependencies):
+    """Tests that buffered prediction logs are written with a single insert_many."""
+    mock_collection, _, _ = mock_app_dependencies
+
+    observe_insert_latency = MagicMock()
+
+    async def run():
+        prediction_logger = PredictionLogger(max_docs=10, interval=0.05, observe_insert_latency=observe_insert_latency)
+        prediction_logger.start()
+        for i in range(3):
+            prediction_logger.put({"text": str(i)})
+        await asyncio.sleep(0.2)
+        await prediction_logger.stop()
+
+    asyncio.run(run())
+
+    mock_collection.insert_many.assert_called_once_with(
+        [{"text": "0"}, {"text": "1"}, {"text": "2"}], ordered=False
+    )
+    observe_insert_latency.assert_called_once()
+
+def test_prediction_logger_stop_keeps_batch_being_inserted(mock_app_dependencies):
+    """Tests that stopping the logger mid-insert writes that batch again instead of dropping it."""
+    mock_collection, _, _ = mock_app_dependencies
+    inserting = asyncio.Event()
+    written = []
+
+    async def insert_many(documents, ordered):
+        if not written:
+            written.append(None)
+            inserting.set()
+            await asyncio.sleep(10)  # Cancelled by stop()
+        written.append(list(documents))
+    mock_collection.insert_many.side_effect = insert_many
+
+    async def run():
+        prediction_logger = PredictionLogger(max_docs=10, interval=0)
+        prediction_logger.start()
+        for i in range(3):
+            prediction_logger.put({"text": str(i)})
+        await inserting.wait()
+        prediction_logger.put({"text": "3"})
+        await prediction_logger.stop()
+
+    asyncio.run(run())
+
+    assert written[1:] == [[{"text": str(i)} for i in range(4)]]
 
 
 # --- Integration Test ---
@@ -141,7 +392,7 @@ def test_integration_real_model_predict(monkeypatch, mock_app_dependencies):
         assert model_name in data["predictions"]
         prediction = data["predictions"][model_name]["top_intent"]
         assert prediction == "confusion"
-        
-        mock_collection.insert_one.assert_called_once()
     
+    mock_collection.insert_many.assert_called_once()
+
     print("\n[Integration Test] Passed: Real model loaded and predicted correctly.")
@@ -132,6 +132,13 @@ def test_preprocess_text_stopwords(clf_with_stopwords):
     result_tensor = clf_with_stopwords.preprocess_text("uma frase de teste")
     assert result_tensor.numpy() == b'frase teste'
 
+def test_preprocess_batch_matches_preprocess_text(clf_with_stopwords, clf_minimal):
+    """Testa se o pré-processamento vetorizado equivale ao feito texto a texto."""
+    texts = ["uma frase de teste", "Oi?", "o que é isso, amigo!", "de um", ""]
+    for clf in (clf_with_stopwords, clf_minimal):
+        expected = [clf.preprocess_text(tf.constant(t)).numpy() for t in texts]
+        assert clf.preprocess_batch(tf.constant(texts)).numpy().tolist() == expected
+
 # --- Testes de Sanidade Local (Médios) ---
 
 def test_local_train_model_created(clf_local_trained):
@@ -150,6 +157,19 @@ def test_local_predict_sanity(clf_local_trained):
     assert list(probs.keys()) == list(clf.codes)
     assert sum(probs.values()) == pytest.approx(1.0)
 
+def test_local_predict_batch_matches_predict(clf_local_trained):
+    """Testa se a predição em lote (usada pela API) equivale à `predict`."""
+    clf = clf_local_trained
+    texts = ["oi como vai", "não entendi nada", "?"]
+    batch_results = clf.predict_batch(texts)
+    
+    assert len(batch_results) == len(texts)
+    for (top_intent, probs), (expected_intent, expected_probs) in zip(batch_results, clf.predict(texts)):
+        assert top_intent == expected_intent
+        # As probabilidades vêm em lista, na mesma ordem de `clf.codes`
+        assert list(expected_probs.keys()) == list(clf.codes)
+        assert probs == pytest.approx(list(expected_probs.values()), abs=1e-5)
+
 def test_one_hot_encoder_local(clf_local_trained):
     """Valida o one-hot encoder usando o modelo local treinado."""
     clf = clf_local_trained